@@ -1,6 +1,6 @@
 import numpy as np
+import scipy.linalg
 import matplotlib.pyplot as plt
-from sklearn.metrics.pairwise import rbf_kernel
 from sklearn.metrics import mean_squared_error, mean_absolute_error
 
 sign = lambda x: np.where(x >= 0, 1, -1)
@@ -18,6 +18,57 @@ def repeat2D(A, rep):
     return np.repeat(A, rep).reshape(len(A), rep)
 
 
+def squaredDistances(X, Y):
+    """
+    ||x - y||^2 between every row of X and every row of Y, shape (len(X), len(Y))
+    """
+    X = X if X.ndim == 2 else X.reshape(-1, 1)
+    Y = Y if Y.ndim == 2 else Y.reshape(-1, 1)
+    d = np.sum(X**2, axis=1)[:, np.newaxis] - 2 * X @ Y.T + np.sum(Y**2, axis=1)
+    return np.maximum(d, 0, out=d)
+
+
+class LeastSquares:
+    def __init__(self, phi, method="lstsq", ridge=0.0):
+        """
+        Factorises phi once for min ||phi W - Y||^2 + ridge ||W||^2 over any targets Y.
+        method "lstsq" (SVD, handles rank deficient phi), "qr" or "cholesky"
+        (of the normal equations, cheapest but least accurate)
+        """
+        self.method = method
+        self.ridge = ridge
+        self.n = phi.shape[0]
+
+        if method == "lstsq":
+            self.U, s, self.Vt = np.linalg.svd(phi, full_matrices=False)
+            # drop directions lstsq would treat as zero
+            keep = s > s.max() * max(phi.shape) * np.finfo(phi.dtype).eps
+            self.f = np.zeros_like(s)
+            self.f[keep] = s[keep] / (s[keep] ** 2 + ridge)
+        elif method == "qr":
+            A = phi if ridge == 0 else np.vstack((phi, np.sqrt(ridge) * np.eye(phi.shape[1])))
+            self.Q, self.R = np.linalg.qr(A)
+        elif method == "cholesky":
+            self.phi = phi
+            self.cho = scipy.linalg.cho_factor(phi.T @ phi + ridge * np.eye(phi.shape[1]))
+        else:
+            raise ValueError(f"unknown method {method}")
+
+    def solve(self, Y):
+        if self.method == "lstsq":
+            f = self.f if Y.ndim == 1 else self.f[:, np.newaxis]
+            return self.Vt.T @ (f * (self.U.T @ Y))
+        if self.method == "qr":
+            # the ridge rows of the augmented targets are 0
+            return scipy.linalg.solve_triangular(self.R, self.Q[: self.n].T @ Y)
+        return scipy.linalg.cho_solve(self.cho, self.phi.T @ Y)
+
+
+# name -> metric(y_true, y_pred, multioutput=...) for RBF_NET.evaluate
+METRICS = {"mse": mean_squared_error, "mae": mean_absolute_error}
+
+
+
 class RBF_NET:
     def __init__(self, rbfs_mean, rbfs_variance, activation=lambda x: x):
 
@@ -27,24 +78,69 @@ class RBF_NET:
         self.rbfs_variance = rbfs_variance
         self.activation = activation
 
+        # (key, phi) of the last phi(X), don't modify the returned matrix
+        self.phi_cache = (None, None)
+        # (key, LeastSquares) of the last train_batch, new targets skip the factorisation
+        self.lsq_cache = (None, None)
+
+    def gamma(self):
+        """
+        1/(2 var^2) per rbf, a scalar rbfs_variance is shared by all rbfs
+        """
+        return 1 / (2 * np.ravel(self.rbfs_variance) ** 2)
+
     def phi(self, X):
+        """
+        Design matrix (samples, rbfs), the last one is cached by the
+        contents of X, rbfs_mean and rbfs_variance so predict/mse/mae on
+        the same inputs evaluate the kernel once
+        """
         X = X if len(X.shape) == 2 else X.reshape(-1,1)
         Y = self.rbfs_mean if len(self.rbfs_mean.shape) == 2 else self.rbfs_mean.reshape(-1,1)
 
-        phi = rbf_kernel(X, Y, gamma=1/(2 * self.rbfs_variance ** 2))
+        key = (
+            X.shape,
+            hash(X.tobytes()),
+            hash(Y.tobytes()),
+            hash(np.asarray(self.rbfs_variance).tobytes()),
+        )
+        if self.phi_cache[0] == key:
+            return self.phi_cache[1]
+
+        phi = squaredDistances(X, Y)
+        np.exp(np.multiply(phi, -self.gamma(), out=phi), out=phi)
+        self.phi_cache = (key, phi)
 
         return phi
 
-    def train_batch(self, X, Y, max_epochs=1, eta=1, callback=None):
+    def train_batch(self, X, Y, max_epochs=1, eta=1, callback=None, method="lstsq", ridge=0.0, lsq=None):
         """
         Return # epochs to convergence (always 1)
+        Least squares without forming an inverse, see LeastSquares,
+        lsq: a LeastSquares of phi(X) to share one factorisation across nets
         """
-
-        phi = self.phi(X)
-
-        print (phi.shape)
-
-        self.W = np.linalg.inv(phi.T @ phi) @ phi.T @ Y
+        if lsq is not None:
+            self.W = lsq.solve(Y)
+            callback() if callback else None
+            return 1
+
+        key = (
+            X.shape,
+            hash(X.tobytes()),
+            hash(self.rbfs_mean.tobytes()),
+            hash(np.asarray(self.rbfs_variance).tobytes()),
+            method,
+            ridge,
+        )
+        if self.lsq_cache[0] == key:
+            lsq = self.lsq_cache[1]
+        else:
+            phi = self.phi(X)
+            print (phi.shape)
+            lsq = LeastSquares(phi, method, ridge)
+            self.lsq_cache = (key, lsq)
+
+        self.W = lsq.solve(Y)
 
         print (self.W.shape)
         callback() if callback else None
@@ -57,37 +153,177 @@ class RBF_NET:
         self.W += delW
         return np.max(np.abs(delW))
 
-    def train_delta_batch(self, X, Y, max_epochs=1000, eta=0.01, callback=None):
+    def train_delta_batch(self, X, Y, max_epochs=1000, eta=0.01, callback=None, batch_size=1):
         """
-        Return # epochs to convergence (when error < 0.01)
+        Return # epochs to convergence (when the mse changes by < 10**-5)
+        batch_size samples per update (mean gradient, so eta doesn't need to
+        shrink as batches grow), 1 is the sequential delta rule.
+        phi(X) is computed once and reused for the updates and the mse.
         """
-        self.W = np.random.randn(*self.rbfs_mean.shape)
-        
-        old_e = 0
+        Y = Y if Y.ndim == 2 else Y.reshape(-1, 1)
 
         phi_X = self.phi(X)
-        
+        self.W = np.random.randn(phi_X.shape[1], Y.shape[1])
+
+        old_e = 0
+
         for epoch in range(1, max_epochs):
-            maxDelW = 0
-            for i in range(len(X)):
-                Y_example = Y[i : i + 1]
-                phi_X_example = phi_X[i : i + 1]
-                maxDelW = max(self.train_delta_single(phi_X_example, Y_example, eta), maxDelW)
-            new_e = self.mse(X,Y)
+            for start in range(0, len(X), batch_size):
+                phi_batch = phi_X[start : start + batch_size]
+                e = Y[start : start + batch_size] - self.activation(phi_batch @ self.W)
+                self.W += eta * phi_batch.T @ e / len(phi_batch)
+            new_e = np.mean((self.activation(phi_X @ self.W) - Y) ** 2)
             if abs(old_e - new_e) < 10**-5:
                 break
             old_e = new_e
         
         return epoch
 
-    def predict(self, X):
-        return self.activation(self.phi(X) @ self.W)
+    def gradient(self, X, Y, rbfs_mean, log_var, W):
+        """
+        Returns (mse, (grad_mean, grad_log_var, grad_W)) of the linear output
+        for the given parameters
+        """
+        dist = squaredDistances(X, rbfs_mean)
+        inv_var2 = np.exp(-2 * log_var)
+        phi = np.exp(-0.5 * dist * inv_var2)
+        e = phi @ W - Y
+
+        # dmse/dphi * phi, shared by the mean and variance gradients
+        g = (e @ W.T) * phi * (2 / e.size)
+        grad_W = phi.T @ e * (2 / e.size)
+        grad_mean = (g.T @ X - g.sum(axis=0)[:, np.newaxis] * rbfs_mean) * inv_var2[:, np.newaxis]
+        grad_log_var = np.sum(g * dist, axis=0) * inv_var2
+
+        return np.mean(e ** 2), (grad_mean, grad_log_var, grad_W)
+
+    def train_gradient(self, X, Y, max_epochs=1000, eta=0.01, callback=None, tol=10**-6):
+        """
+        Return # epochs to convergence (when the mse drops by < tol relative)
+        Joint gradient descent on rbfs_mean, log rbfs_variance (one per rbf
+        after training) and W, starting from the train_batch weights.
+        A step that raises the mse (or overflows) is undone and eta halved,
+        accepted steps grow eta by 10%.
+        The output is taken as linear, activation is ignored in the gradient.
+        """
+        X = X if X.ndim == 2 else X.reshape(-1, 1)
+        Y = Y if Y.ndim == 2 else Y.reshape(-1, 1)
+
+        self.rbfs_mean = np.array(self.rbfs_mean, dtype=float)
+        self.rbfs_variance = np.zeros(len(self.rbfs_mean)) + np.ravel(self.rbfs_variance)
+        self.train_batch(X, Y)
+
+        params = (self.rbfs_mean, np.log(self.rbfs_variance), self.W)
+        old_e, grads = self.gradient(X, Y, *params)
+
+        for epoch in range(1, max_epochs):
+            step = tuple(p - eta * g for p, g in zip(params, grads))
+            with np.errstate(over="ignore", invalid="ignore"):
+                new_e, new_grads = self.gradient(X, Y, *step)
+
+            if not new_e <= old_e:
+                eta /= 2
+                if eta < 10**-12:
+                    break
+                continue
+
+            converged = old_e - new_e < tol * old_e
+            params, old_e, grads = step, new_e, new_grads
+            eta *= 1.1
+            self.rbfs_mean, self.W = params[0], params[2]
+            self.rbfs_variance = np.exp(params[1])
+
+            callback() if callback else None
+            if converged:
+                break
+
+        return epoch
+
+    def predict_chunks(self, X, chunk_size=4096, dtype=np.float64):
+        """
+        Yields (start, predictions) for X[start : start + chunk_size],
+        the kernel is only ever chunk_size x rbfs and isn't cached.
+        Distances are always float64 (the expanded ||x||^2 - 2 x.y + ||y||^2
+        cancels badly in float32 away from the origin), dtype applies to the
+        kernel and the product with W.
+        """
+        X = X if X.ndim == 2 else X.reshape(-1, 1)
+        W = self.W.astype(dtype, copy=False)
+        gamma = self.gamma()
+
+        for start in range(0, len(X), chunk_size):
+            dist = squaredDistances(X[start : start + chunk_size].astype(np.float64, copy=False), self.rbfs_mean)
+            np.exp(np.multiply(dist, -gamma, out=dist), out=dist)
+            yield start, self.activation(dist.astype(dtype, copy=False) @ W)
+
+    def predict(self, X, chunk_size=None, dtype=np.float64, out=None):
+        """
+        chunk_size=None evaluates (and caches) the whole phi(X),
+        otherwise predictions are written chunk by chunk so memory stays
+        bounded by chunk_size. Either way the result is written into out
+        if given, else returned as dtype.
+        """
+        shape = (len(X),) + self.W.shape[1:]
+        if out is not None and out.shape != shape:
+            raise ValueError(f"out has shape {out.shape}, predictions are {shape}")
+
+        if chunk_size is None:
+            pred = self.activation(self.phi(X) @ self.W)
+            if out is None:
+                return pred.astype(dtype, copy=False)
+            out[...] = pred
+            return out
+
+        if out is None:
+            out = np.empty(shape, dtype=dtype)
+        for start, pred in self.predict_chunks(X, chunk_size, dtype):
+            out[start : start + len(pred)] = pred
+        return out
+
+    def evaluate(self, X, Y, metrics=("mae", "mse"), multioutput="uniform_average"):
+        """
+        Returns {key: error} from one prediction of X.
+        metrics is a list of names in METRICS (keyed by name) or callables
+        (y_true, y_pred) (keyed by their position in the list), or a
+        {key: name or callable} mapping.
+        multioutput="raw_values" gives one error per output column for named metrics
+        """
+        pred = self.predict(X)
+        Y = Y if Y.ndim == 2 else Y.reshape(-1, 1)
+        pred = pred if pred.ndim == 2 else pred.reshape(-1, 1)
+
+        if not isinstance(metrics, dict):
+            metrics = {i if callable(m) else m: m for i, m in enumerate(metrics)}
+
+        scores = {}
+        for key, metric in metrics.items():
+            if callable(metric):
+                scores[key] = metric(Y, pred)
+            else:
+                scores[key] = METRICS[metric](Y, pred, multioutput=multioutput)
+        return scores
 
     def mse(self, X, Y):
-        return mean_squared_error(self.predict(X), Y)
+        return self.evaluate(X, Y, ["mse"])["mse"]
 
     def mae(self, X, Y):
-        return mean_absolute_error(self.predict(X), Y)
+        return self.evaluate(X, Y, ["mae"])["mae"]
+
+
+def checkPredictChunks(offsets=(0, 10, 100, 1000), n=20000, rbfs=10, variance=0.1, rng=np.random):
+    """
+    Largest difference between float32 chunked and float64 predictions for
+    2-D inputs shifted away from the origin by each offset
+    Returns {offset: max abs difference}
+    """
+    errors = {}
+    for offset in offsets:
+        X = offset + rng.random((n, 2))
+        net = RBF_NET(offset + rng.random((rbfs, 2)), variance)
+        net.W = rng.standard_normal((rbfs, 1))
+        exact = net.predict(X, chunk_size=4096)
+        errors[offset] = np.max(np.abs(net.predict(X, chunk_size=4096, dtype=np.float32) - exact))
+    return errors
 
 
 def runWithParams(x, y, x_val, y_val, means, variance, training_method):
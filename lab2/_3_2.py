@@ -1,74 +1,200 @@
+import os
 import numpy as np
 import seaborn as sn
 import pandas as pd
 import matplotlib.pyplot as plt
-from _3_1 import RBF_NET, X, Y_SIN, Y_SQUARE, X_VAL, Y_SIN_VAL, Y_SQUARE_VAL
+from multiprocessing import Pool
+from _3_1 import RBF_NET, LeastSquares, squaredDistances, X, Y_SIN, Y_SQUARE, X_VAL, Y_SIN_VAL, Y_SQUARE_VAL
 
 
 def getNoisy(input_):
     return input_ + np.sqrt(0.1) * np.random.randn(*(input_.shape))
 
 
-def findBestParams(
-    x,
-    y,
-    x_val,
-    y_val,
-    training_method,
-    apply_noise=True,
-    randomize_rbfs=False,
-    max_epochs=1000,
-    hidden_range=np.arange(2, 41),
-    var_range=np.round(np.arange(0.2, 1.2, 0.2), 2),
-    eta=0.01,
-):
+def gridErrors(x, ys, x_val, y_vals, hidden_range, var_range, randomize_rbfs=False):
+    """
+    Validation mae of train_batch for every (run, hidden_num, variance),
+    run k trains on ys[:, k] and validates on y_vals[:, k].
+    Squared distances are computed once per center layout and every
+    variance's kernel is an exp of them, all runs sharing a layout are
+    solved with one factorisation.
+    Returns errors (runs, hidden, variance)
+    """
+    runs = ys.shape[1]
+    errors = np.ndarray((runs, len(hidden_range), len(var_range)))
 
-    num_runs = 10
+    for i, hidden_num in enumerate(hidden_range):
 
-    errors = np.ndarray((num_runs, len(hidden_range), len(var_range)))
-    num_epochs = np.ndarray((num_runs, len(hidden_range), len(var_range)))
+        # (centers, runs using them)
+        if randomize_rbfs:
+            layouts = [(np.random.uniform(0, 2 * np.pi, hidden_num), [run]) for run in range(runs)]
+        else:
+            layouts = [(np.arange(0, 2 * np.pi, 2 * np.pi / hidden_num), list(range(runs)))]
 
-    for run in range(num_runs):
+        for rbfs_mean, cols in layouts:
+            dist = squaredDistances(x, rbfs_mean)
+            dist_val = squaredDistances(x_val, rbfs_mean)
 
-        # print ("run", run)
+            for j, rbfs_variance in enumerate(var_range):
+                gamma = 1 / (2 * rbfs_variance ** 2)
+                W = LeastSquares(np.exp(-gamma * dist)).solve(ys[:, cols])
+                pred = np.exp(-gamma * dist_val) @ W
+                e = np.mean(np.abs(pred - y_vals[:, cols]), axis=0)
+                errors[cols, i, j] = np.where(np.isnan(e), np.inf, e)
 
-        y, y_val = getNoisy(np.array([y, y_val])) if apply_noise else (y, y_val)
+    return errors
 
-        for i, hidden_num in enumerate(hidden_range):
-            for j, rbfs_variance in enumerate(var_range):
 
-                cont = False
+def cellErrors(x, y, x_val, y_val, training_method, hidden_num, var_range, randomize_rbfs=False, max_epochs=1000, eta=0.01):
+    """
+    Validation mae and epochs of training_method for one hidden_num over var_range
+    Returns (errors, num_epochs) (variance,)
+    """
+    if training_method == "train_batch":
+        errors = gridErrors(x, y, x_val, y_val, [hidden_num], var_range, randomize_rbfs)[0, 0]
+        return errors, np.ones_like(errors)
+
+    errors = np.ndarray(len(var_range))
+    num_epochs = np.ndarray(len(var_range))
+
+    for j, rbfs_variance in enumerate(var_range):
+
+        cont = False
+
+        while not cont:
+            rbfs_mean = (
+                np.arange(0, 2 * np.pi, 2 * np.pi / hidden_num)
+                if not randomize_rbfs
+                else np.random.uniform(0, 2 * np.pi, hidden_num)
+            )
+
+            n = RBF_NET(rbfs_mean, rbfs_variance)
 
-                while not cont:
-                    rbfs_mean = (
-                        np.arange(0, 2 * np.pi, 2 * np.pi / hidden_num)
-                        if not randomize_rbfs
-                        else np.random.uniform(0, 2 * np.pi, hidden_num)
-                    )
+            try:
+                eps = n.__getattribute__(training_method)(
+                    x, y, callback=None, max_epochs=max_epochs, eta=eta
+                )
+                cont = True
 
-                    n = RBF_NET(rbfs_mean, rbfs_variance)
+                # plt.plot(X, n.predict(X))
+                # plt.show(block=False)
+                # plt.title(hidden_num)
+                # plt.pause(.1)
+                # plt.clf()
 
-                    try:
-                        eps = n.__getattribute__(training_method)(
-                            x, y, callback=None, max_epochs=max_epochs, eta=eta
-                        )
-                        cont = True
+            except KeyboardInterrupt:
+                exit()
+            except np.linalg.LinAlgError:
+                pass
 
-                        # plt.plot(X, n.predict(X))
-                        # plt.show(block=False)
-                        # plt.title(hidden_num)
-                        # plt.pause(.1)
-                        # plt.clf()
+        e = n.mae(x_val, y_val)
 
-                    except KeyboardInterrupt:
-                        exit()
-                    except np.linalg.LinAlgError:
-                        pass
+        errors[j] = np.inf if np.isnan(e) else e
+        num_epochs[j] = eps
 
-                e = n.mae(x_val, y_val)
+    return errors, num_epochs
+
+
+def runCell(task):
+    run, i, seed, args = task
+    # seeds the global generator used by random centers and delta rule init
+    np.random.seed(seed.generate_state(1))
+    return run, i, cellErrors(*args)
+
+
+def saveGrid(save_file, **arrays):
+    # write next to save_file and swap, an interrupted save keeps the old checkpoint
+    with open(f"{save_file}.tmp", "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(f"{save_file}.tmp", save_file)
+
+
+def runGrid(
+    x,
+    ys,
+    x_val,
+    y_vals,
+    training_method,
+    hidden_range,
+    var_range,
+    save_file=None,
+    randomize_rbfs=False,
+    max_epochs=1000,
+    eta=0.01,
+    seed=0,
+    processes=None,
+):
+    """
+    cellErrors for every (run, hidden_num) over a pool of processes,
+    run k trains on ys[:, k] and validates on y_vals[:, k].
+    Cell (run, i) always gets child run * len(hidden_range) + i of
+    SeedSequence(seed), so results don't depend on the worker or order.
+    Completed cells are checkpointed to save_file (.npz), running again with
+    the same save_file and settings only runs the missing cells and uses the
+    saved targets, so noise drawn for the new call is ignored.
+    Returns (errors, num_epochs) (runs, hidden, variance)
+    """
+    runs, hidden = ys.shape[1], len(hidden_range)
+    errors = np.zeros((runs, hidden, len(var_range)))
+    num_epochs = np.zeros((runs, hidden, len(var_range)))
+    done = np.zeros((runs, hidden), dtype=bool)
+
+    # everything besides the targets that decides a cell's result
+    settings = dict(
+        training_method=training_method,
+        randomize_rbfs=randomize_rbfs,
+        max_epochs=max_epochs,
+        eta=eta,
+        seed=seed,
+        hidden_range=hidden_range,
+        var_range=var_range,
+    )
 
-                errors[run][i][j] = np.inf if np.isnan(e) else e
-                num_epochs[run][i][j] = eps
+    if save_file is not None and os.path.exists(save_file):
+        with np.load(save_file) as saved:
+            if saved["ys"].shape != ys.shape or any(
+                not np.array_equal(saved[name], value) for name, value in settings.items()
+            ):
+                raise ValueError(f"{save_file} was run with different settings")
+            errors, num_epochs, done = saved["errors"], saved["num_epochs"], saved["done"]
+            ys, y_vals = saved["ys"], saved["y_vals"]
+
+    seeds = np.random.SeedSequence(seed).spawn(runs * hidden)
+    tasks = [
+        (
+            run,
+            i,
+            seeds[run * hidden + i],
+            (x, ys[:, [run]], x_val, y_vals[:, [run]], training_method, hidden_num, var_range, randomize_rbfs, max_epochs, eta),
+        )
+        for run in range(runs)
+        for i, hidden_num in enumerate(hidden_range)
+        if not done[run, i]
+    ]
+
+    with Pool(processes) as pool:
+        for run, i, (e, eps) in pool.imap_unordered(runCell, tasks):
+            errors[run, i], num_epochs[run, i], done[run, i] = e, eps, True
+            if save_file is not None:
+                saveGrid(
+                    save_file,
+                    errors=errors,
+                    num_epochs=num_epochs,
+                    done=done,
+                    ys=ys,
+                    y_vals=y_vals,
+                    **settings,
+                )
+
+    return errors, num_epochs
+
+
+def plotErrors(errors, num_epochs, hidden_range, var_range):
+    """
+    Heatmap of the mean validation error over runs, minimum in white
+    Returns (best_error, best_error_std, best_params, best_error_ep)
+    """
+    num_runs = len(errors)
 
     errors_mean = np.mean(errors, axis=0)
     errors_std = np.std(errors, axis=0)
@@ -98,6 +224,53 @@ def findBestParams(
     return best_error, best_error_std, best_params, best_error_ep
 
 
+def findBestParams(
+    x,
+    y,
+    x_val,
+    y_val,
+    training_method,
+    apply_noise=True,
+    randomize_rbfs=False,
+    max_epochs=1000,
+    hidden_range=np.arange(2, 41),
+    var_range=np.round(np.arange(0.2, 1.2, 0.2), 2),
+    eta=0.01,
+    save_file=None,
+    processes=None,
+):
+
+    num_runs = 10
+
+    ys, y_vals = [], []
+    for run in range(num_runs):
+        y, y_val = getNoisy(np.array([y, y_val])) if apply_noise else (y, y_val)
+        ys.append(y)
+        y_vals.append(y_val)
+    ys, y_vals = np.hstack(ys), np.hstack(y_vals)
+
+    if training_method == "train_batch" and save_file is None:
+        errors = gridErrors(x, ys, x_val, y_vals, hidden_range, var_range, randomize_rbfs=randomize_rbfs)
+        num_epochs = np.ones_like(errors)
+    else:
+        errors, num_epochs = runGrid(
+            x,
+            ys,
+            x_val,
+            y_vals,
+            training_method,
+            hidden_range,
+            var_range,
+            save_file=save_file,
+            randomize_rbfs=randomize_rbfs,
+            max_epochs=max_epochs,
+            eta=eta,
+            processes=processes,
+        )
+
+    return plotErrors(errors, num_epochs, hidden_range, var_range)
+
+
 if __name__ == "__main__":
 
     # 3.2.1 3.2.3
@@ -9,113 +9,119 @@ shape = 11
 
 rbfs_mean = np.random.sample(shape) *2*np.pi
 rbfs_variance = np.zeros(shape) + 3
-rbfs_winner = np.zeros(shape)
 
 eta = 0.1
 
-def winner_takes_all():
-    global rbfs_mean
-    global rbfs_variance
-    global rbfs_winner
-    global eta
 
-    n = RBF_NET(rbfs_mean, rbfs_variance)
-    n.W = np.random.sample(shape) -0.5
-
-    print("starting pos ", np.sort(rbfs_mean))
+class CompetitiveLearning:
+    def __init__(self, eta=0.1, n_epochs=20, batch_size=1, shared=False, revive_dead=False, rng=np.random):
+        """
+        batch_size: samples per update, 1 is the online rule, None the whole data set
+        shared: every center moves by eta * min_dist / dist (shared_winner)
+                instead of only the winner moving by eta
+        revive_dead: centers that win no sample in an epoch restart at a random sample
+        """
+        self.eta = eta
+        self.n_epochs = n_epochs
+        self.batch_size = batch_size
+        self.shared = shared
+        self.revive_dead = revive_dead
+        self.rng = rng
+
+    def fit(self, X, centers):
+        """
+        Returns the trained centers (k, d), X is (n, d), 1-D X / centers are
+        treated as d = 1. Loss per epoch (sum of squared winner distances)
+        in self.loss, wins per center in self.wins.
+        """
+        X = X if X.ndim == 2 else X.reshape(-1, 1)
+        C = np.array(centers, dtype=float).reshape(len(centers), -1)
+        batch_size = self.batch_size or len(X)
+
+        self.loss = []
+        self.wins = np.zeros(len(C), dtype=int)
+
+        for _ in range(self.n_epochs):
+            epoch_loss = 0
+            epoch_wins = np.zeros(len(C), dtype=int)
+
+            for start in range(0, len(X), batch_size):
+                batch = X[start : start + batch_size]
+                dist = squaredDistances(batch, C)
+                winner = np.argmin(dist, axis=1)
+                min_dist = dist[np.arange(len(batch)), winner]
+
+                if self.shared:
+                    # a center on top of the sample counts as the winner
+                    share = np.divide(min_dist[:, np.newaxis], dist, out=np.ones_like(dist), where=dist > 0)
+                else:
+                    share = np.zeros_like(dist)
+                    share[np.arange(len(batch)), winner] = 1
+
+                # move eta per (shared) sample towards their mean, at most all the way
+                total = share.sum(axis=0)
+                moved = total > 0
+                target = (share.T @ batch)[moved] / total[moved, np.newaxis]
+                rate = np.minimum(self.eta * total[moved], 1)[:, np.newaxis]
+                C[moved] += rate * (target - C[moved])
+
+                epoch_loss += np.sum(min_dist)
+                epoch_wins += np.bincount(winner, minlength=len(C))
+
+            if self.revive_dead:
+                dead = epoch_wins == 0
+                C[dead] = X[self.rng.choice(len(X), np.sum(dead))]
+
+            self.loss.append(epoch_loss)
+            self.wins += epoch_wins
+
+        return C
+
+
+def printDistribution(rbfs_mean):
+    s_rbfs_mean = np.sort(rbfs_mean)
+    print("end pos ", s_rbfs_mean)
+    dist = np.diff(s_rbfs_mean)
+    print("max_dist ", np.max(dist))
+    print("min_dist ", np.min(dist))
+    print("mean_dist ", np.mean(dist))
 
-    update_loss = []
 
+def winner_takes_all(rbfs_mean=rbfs_mean, eta=eta):
 
+    print("starting pos ", np.sort(rbfs_mean))
 
-    for _ in range(20):
-        epoch_loss = 0
-        for sample_index in range(X.shape[0]):
-            min_index = np.argmin(np.absolute(rbfs_mean - X[sample_index]))
+    cl = CompetitiveLearning(eta=eta)
+    rbfs_mean = cl.fit(X, rbfs_mean).ravel()
 
-            #update
-            delta_mean =  -eta*(rbfs_mean[min_index] - X[sample_index])
-            epoch_loss += np.absolute(delta_mean)
-            rbfs_mean[min_index] += delta_mean
-            rbfs_winner[min_index] += 1
-        update_loss.append(epoch_loss)
+    printDistribution(rbfs_mean)
+    print("num of winning ", cl.wins)
 
-    s_rbfs_mean = np.sort(rbfs_mean)
-    print("end pos ", s_rbfs_mean)
-    print("num of winning ", rbfs_winner)
-    min_dist = 10
-    max_dist = 0
-    mean_dist = 0
-    for i in range(s_rbfs_mean.shape[0]-1):
-        dist = s_rbfs_mean[i+1] - s_rbfs_mean[i]
-        if(max_dist < dist):
-            max_dist = dist
-        if(min_dist > dist):
-            min_dist = dist
-        mean_dist += dist
-    mean_dist = mean_dist/(s_rbfs_mean.shape[0]-1)
-    print("max_dist ", max_dist)
-    print("min_dist ", min_dist)
-    print("mean_dist ", mean_dist)
-
-    plt.plot(update_loss)
+    plt.plot(cl.loss)
     plt.show(block=False)
     plt.title("update_loss")
     plt.show()
     plt.clf()
 
-def shared_winner():
-    global rbfs_mean
-    global rbfs_variance
-    global eta
+    return rbfs_mean
 
-    n = RBF_NET(rbfs_mean, rbfs_variance)
-    n.W = np.random.sample(shape) -0.5
+def shared_winner(rbfs_mean=rbfs_mean, eta=eta):
 
     print("starting pos ", np.sort(rbfs_mean))
-    #print("starting pos ", rbfs_mean)
-
-    update_loss = []
-
-    for _ in range(20):
-        epoch_loss = 0
-        for sample_index in range(X.shape[0]):
-            distance = (np.absolute(rbfs_mean - X[sample_index]))**2
-            #print(X[sample_index])
-            #print(max_dist)
-            #print(distance)
-            min_dist= np.min(distance)
-
-            #update
-            delta_mean =  -eta*min_dist/distance*(rbfs_mean - X[sample_index])
-            epoch_loss += np.average(np.absolute(delta_mean))
-            rbfs_mean += delta_mean
-        update_loss.append(epoch_loss)
-
-    #calculate distribution
-    s_rbfs_mean = np.sort(rbfs_mean)
-    print("end pos ", s_rbfs_mean)
-    min_dist = 10
-    max_dist = 0
-    mean_dist = 0
-    for i in range(s_rbfs_mean.shape[0]-1):
-        dist = s_rbfs_mean[i+1] - s_rbfs_mean[i]
-        if(max_dist < dist):
-            max_dist = dist
-        if(min_dist > dist):
-            min_dist = dist
-        mean_dist += dist
-    mean_dist = mean_dist/(s_rbfs_mean.shape[0]-1)
-    print("max_dist ", max_dist)
-    print("min_dist ", min_dist)
-    print("mean_dist ", mean_dist)
-
-    plt.plot(update_loss)
+
+    cl = CompetitiveLearning(eta=eta, shared=True)
+    rbfs_mean = cl.fit(X, rbfs_mean).ravel()
+
+    printDistribution(rbfs_mean)
+
+    plt.plot(cl.loss)
     plt.show(block=False)
     plt.title("update_loss")
     plt.show()
     plt.clf()
 
+    return rbfs_mean
+
 def ballistic():
     #initialisation
     f = open("data/ballist.dat")
@@ -142,22 +148,7 @@ def ballistic():
 
 
     #CL for rbf distribution
-    update_loss = []
-
-
-    for _ in range(20):
-        epoch_loss = 0
-        for index in range(X.shape[0]):
-            dist = (rbfs_mean[:,0] - X[index,0])**2 + (rbfs_mean[:,1] - X[index,1])**2
-            dist = np.square(dist)
-            min_index = np.argmin(dist)
-
-            # update
-            delta_mean = -eta * (rbfs_mean[min_index,:] - X[index,:])
-            epoch_loss += dist[min_index]
-            rbfs_mean[min_index,:] += delta_mean
-            #rbfs_winner[min_index] += 1
-        update_loss.append(epoch_loss)
+    rbfs_mean = CompetitiveLearning(eta=eta).fit(X, rbfs_mean)
 
 
     plot = True
@@ -175,7 +166,17 @@ def ballistic():
     n = RBF_NET(rbfs_mean, rbfs_variance)
 
     n.train_batch(X,Y)
-    print(n.mae(X_test, Y_test))
+
+    optimise = False
+    if (optimise):
+        #jointly refine centers, per-center widths and weights
+        n.train_gradient(X, Y, max_epochs=5000, eta=0.05)
+
+    # the errors and Y_test_pred share one kernel evaluation (phi_cache holds the last X only)
+    scores = n.evaluate(X_test, Y_test, ["mae", "mse"], multioutput="raw_values")
+    print("mae (distance, height):", scores["mae"])
+    print("mse (distance, height):", scores["mse"])
+    Y_test_pred= n.predict(X_test)
 
     vis = np.arange(0,1,0.01)
     X_vis = np.zeros((vis.shape[0],2))
@@ -185,9 +186,6 @@ def ballistic():
     furtherst = np.argmax(Y[:,0])
 
 
-    Y_test_pred= n.predict(X_test)
-
-
     plot = True
     if (plot):
         plt.plot(Y_vis[:,0], Y_vis[:,1], "o")
@@ -1,66 +1,542 @@
 import numpy as np
+from functools import partial
+from multiprocessing import Pool
+
+def sign(x, out=None, low=-1):
+    """
+    Threshold at 0: 1 where x >= 0, low elsewhere.
+    Written into out if given (reuse it across iterations), else a new int8 array.
+    """
+    if out is None:
+        out = np.empty(np.shape(x), dtype=np.int8)
+    np.greater_equal(x, 0, out=out, casting="unsafe")
+    if low != 0:
+        out *= 1 - low
+        out += low
+    return out
+
+# bits set in every byte value, for numpy without np.bitwise_count
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def pack(states):
+    """
+    Bipolar states (..., N) to packed bits (..., ceil(N/8)) uint8, bit set for +1
+    """
+    return np.packbits(np.asarray(states) > 0, axis=-1)
+
+
+def unpack(packed, N):
+    """
+    Packed bits (..., ceil(N/8)) back to int8 bipolar states (..., N)
+    """
+    return np.unpackbits(packed, axis=-1, count=N).astype(np.int8) * 2 - 1
+
+
+def hamming(a, b):
+    """
+    Number of differing units between packed states, broadcasting over the
+    leading axes (hamming(a[:, None], b[None]) for all pairs, which builds
+    the whole (len(a), len(b), N/8) XOR, chunk b for large sets)
+    """
+    xor = np.bitwise_xor(a, b)
+    bits = np.bitwise_count(xor) if hasattr(np, "bitwise_count") else POPCOUNT[xor]
+    return bits.sum(axis=-1, dtype=np.int64)
+
+
+def overlap(a, b, N):
+    """
+    Overlap x.y / N of packed N-unit states
+    """
+    return (N - 2 * hamming(a, b)) / N
+
+
+class EnergyTrace:
+    """
+    Energy recorder backed by a preallocated array, keeps every every-th
+    value. A full buffer doubles (default), overwrites its oldest values
+    (ring=True) or is appended as raw float64 to the file stream, a ring
+    drops values so it can't also stream them. The stream file holds
+    whole buffers only until flush().
+    """
+
+    def __init__(self, capacity=1024, every=1, ring=False, stream=None):
+        if ring and stream:
+            raise ValueError("EnergyTrace takes ring or stream, not both")
+
+        self.buffer = np.empty(capacity)
+        self.every = every
+        self.ring = ring
+        self.stream = stream
+        self.steps = 0  # values offered
+        self.recorded = 0  # values kept, streamed or overwritten
+        self.count = 0  # values in buffer
+
+        if stream:
+            open(stream, "wb").close()
+
+    def append(self, energy):
+        self.steps += 1
+        if (self.steps - 1) % self.every:
+            return
+
+        if self.count == len(self.buffer):
+            if self.stream:
+                self.flush()
+            elif not self.ring:
+                self.buffer = np.concatenate((self.buffer, np.empty_like(self.buffer)))
+
+        if self.ring:
+            self.buffer[self.recorded % len(self.buffer)] = energy
+            self.count = min(self.count + 1, len(self.buffer))
+        else:
+            self.buffer[self.count] = energy
+            self.count += 1
+        self.recorded += 1
+
+    def extend(self, energies):
+        """
+        append for every value of energies, decimated and stored in slices
+        """
+        energies = np.asarray(energies, dtype=float)
+        kept = energies[(-self.steps) % self.every :: self.every]
+        self.steps += len(energies)
+
+        if self.ring:
+            # only the last len(buffer) values survive
+            dropped = max(len(kept) - len(self.buffer), 0)
+            self.recorded += dropped
+            kept = kept[dropped:]
+            index = (self.recorded + np.arange(len(kept))) % len(self.buffer)
+            self.buffer[index] = kept
+            self.recorded += len(kept)
+            self.count = min(self.count + len(kept), len(self.buffer))
+            return
+
+        while len(kept):
+            if self.count == len(self.buffer):
+                if self.stream:
+                    self.flush()
+                else:
+                    self.buffer = np.concatenate((self.buffer, np.empty_like(self.buffer)))
+            n = min(len(kept), len(self.buffer) - self.count)
+            self.buffer[self.count : self.count + n] = kept[:n]
+            self.count += n
+            self.recorded += n
+            kept = kept[n:]
+
+    def flush(self):
+        if self.stream and self.count:
+            with open(self.stream, "ab") as f:
+                self.buffer[: self.count].tofile(f)
+            self.count = 0
+
+    def values(self):
+        """
+        Recorded energies in order (including the streamed ones)
+        """
+        if self.stream:
+            return np.concatenate((np.fromfile(self.stream), self.buffer[: self.count]))
+        if self.ring and self.recorded > len(self.buffer):
+            return np.roll(self.buffer, -(self.recorded % len(self.buffer)))
+        return self.buffer[: self.count].copy()
+
+    def __len__(self):
+        return self.count if self.ring else self.recorded
+
+    def __getitem__(self, index):
+        return self.values()[index]
+
+    def __array__(self, dtype=None, copy=None):
+        return self.values() if dtype is None else self.values().astype(dtype)
 
-sign = np.vectorize(lambda x: np.where(x>=0, 1, -1))
-# sign = np.sign
 
 class Hopfield:
-    def train(self, samples, delete_diagonal=False):
+    scale = 1  # energy factor, 1 / P while W holds exact integer sums
+    tie_eps = 0  # fields within tie_eps of 0 count as 0, see set_tie_eps
+
+    def train(self, samples, delete_diagonal=False, dtype=np.float64, chunk_size=None, rule="hebbian"):
+        """
+        rule "hebbian": W = X^T X / P
+             "pseudoinverse": projection onto the span of the patterns, W = X^+ X
+             "storkey": Storkey's rule, corrects each new pattern for the local
+             fields of the patterns already stored
+        dtype float64/float32 sets the weight dtype, an integer dtype (int32)
+        keeps W the exact integer X^T X and applies 1 / P only to energies
+        (sign(W x) doesn't depend on it), hebbian only.
+        chunk_size streams the samples through the update in blocks of rows.
+        """
+        if rule not in ("hebbian", "pseudoinverse", "storkey"):
+            raise ValueError(f"unknown rule {rule}")
+        if rule != "hebbian" and not np.issubdtype(dtype, np.floating):
+            raise ValueError(f"{rule} rule needs a float dtype")
+
         width = samples.shape[1]
-        self.W = np.zeros((width, width))
-        for x in samples:
-            self.W += np.outer(x, x)
+        self.rule = rule
+        self.delete_diagonal = delete_diagonal
+        self.W_acc = np.zeros((width, width), dtype=dtype)  # W before normalising / removing the diagonal
+        self.n_patterns = 0
+        # packed patterns, stored is a view of stored_buf whose capacity doubles when full
+        self.stored_buf = np.empty((0, (width + 7) // 8), dtype=np.uint8)
+        self.stored = self.stored_buf
+        self.add_patterns(samples, chunk_size=chunk_size)
+
+    def add_patterns(self, samples, chunk_size=None):
+        """
+        Add patterns to an already trained network without retraining,
+        a single hebbian pattern is a rank-1 update of the accumulated weights.
+        """
+        samples = np.atleast_2d(samples)
+        chunk_size = chunk_size or len(samples)
+
+        for start in range(0, len(samples), chunk_size):
+            X = samples[start : start + chunk_size].astype(self.W_acc.dtype)
+            if self.rule == "pseudoinverse":
+                self.W_acc += self.projection_update(X)
+            elif self.rule == "storkey":
+                for x in X:
+                    self.W_acc += self.storkey_update(x)
+            elif len(X) == 1:
+                self.W_acc += np.outer(X[0], X[0])
+            else:
+                self.W_acc += X.T @ X
+
+        old = self.n_patterns
+        self.n_patterns += len(samples)
+        if self.n_patterns > len(self.stored_buf):
+            grown = np.empty((max(self.n_patterns, 2 * len(self.stored_buf)), self.stored_buf.shape[1]), dtype=np.uint8)
+            grown[:old] = self.stored_buf[:old]
+            self.stored_buf = grown
+        self.stored_buf[old : self.n_patterns] = pack(samples)
+        self.stored = self.stored_buf[: self.n_patterns]
+
+        if self.rule == "hebbian" and np.issubdtype(self.W_acc.dtype, np.integer):
+            self.W = self.W_acc.copy()
+            self.scale = 1 / self.n_patterns
+        elif self.rule == "hebbian":
+            self.W = self.W_acc / self.n_patterns
+            self.scale = 1
+        else:
+            self.W = self.W_acc.copy()
+            self.scale = 1
 
         # Do we get rid of diagonal?
-        if delete_diagonal:
-            np.fill_diagonal(self.W,0)
+        if self.delete_diagonal:
+            np.fill_diagonal(self.W, 0)
+
+        self.set_tie_eps()
+
+    def set_tie_eps(self):
+        """
+        A field that is exactly 0 (e.g. W = X^T X / P) comes out of a float
+        W x as +-rounding residue whose sign depends on the summation order,
+        so predict_sync, predict_sync_rows and predict_block would break the
+        tie differently. Fields within a bound on that residue are treated
+        as 0 (-> +1) by all of them; exact integer weights need none.
+        Call again after assigning W by hand.
+        """
+        if np.issubdtype(self.W.dtype, np.integer):
+            self.tie_eps = 0
+            return
+        N = self.W.shape[0]
+        self.tie_eps = 4 * np.sqrt(N) * np.finfo(self.W.dtype).eps * np.abs(self.W).sum(axis=1).max()
 
-        self.W = self.W / len(samples)h
+    def projection_update(self, X):
+        """
+        Projection onto the part of the rows of X outside the span of the
+        stored patterns, adding it keeps W_acc the projection onto all of them
+        """
+        R = X - X @ self.W_acc
+        _, s, Vt = np.linalg.svd(R, full_matrices=False)
+        V = Vt[s > 1e-8 * np.sqrt(X.shape[1])]  # patterns already in the span add nothing
+        return V.T @ V
+
+    def storkey_update(self, x):
+        """
+        dw_ij = (x_i x_j - x_i h_ji - h_ij x_j) / N, h_ij = sum_{k != i,j} w_ik x_k
+        """
+        W = self.W_acc
+        xx = x * x
+        u = W @ x - np.diag(W) * x  # h_ij = u_i - w_ij x_j
+        dW = np.outer(x, x) - np.outer(x, u) - np.outer(u, x) + xx[:, np.newaxis] * W.T + W * xx
+        return dW / len(x)
 
     def predict_sync(self, x, max_iter=200):
 
         self.past_energy = []
-        x_cur = np.copy(x.T)
+
+        # int8 states, buffers reused across iterations
+        x_cur = np.array(x.T, dtype=np.int8)
+        x_next = np.empty_like(x_cur)
+        field = np.empty(x_cur.shape, dtype=self.W.dtype)
 
         for _ in range(max_iter):
-            self.past_energy.append(self.energy(x_cur))
-            x_next = sign(self.W @ x_cur)
-            if np.all(x_next == x_cur):
+            np.matmul(self.W, x_cur, out=field)
+            # energy of each state, -x^T W x
+            self.past_energy.append(np.round(-self.scale * np.sum(x_cur * field, axis=0), 5))
+            field += self.tie_eps
+            sign(field, out=x_next)
+            if np.array_equal(x_next, x_cur):
                 break
-            x_cur = x_next
+            x_cur, x_next = x_next, x_cur
         return x_cur.T.astype(int)
 
-    def predict_async(self, x, max_iter=100000):
+    def predict_sync_rows(self, X, max_iter=200):
+        """
+        Synchronous recall of the rows of X where every row stops on its own,
+        at a fixed point or in a period-2 cycle, and is dropped from the
+        active batch. Cycling rows return the state predict_sync would end
+        on after max_iter updates.
+        Returns (states, updates per row, status per row), status is
+        "converged", "cycle" or "max_iter"
+        """
+        x_cur = np.array(X, dtype=np.int8)
+        B = len(x_cur)
+
+        final = np.empty_like(x_cur)
+        iterations = np.full(B, max_iter)
+        status = np.full(B, "max_iter", dtype="<U9")
+
+        active = np.arange(B)
+        x_prev = None
+
+        for it in range(max_iter):
+            x_next = sign(x_cur @ self.W.T + self.tie_eps)
+
+            fixed = np.all(x_next == x_cur, axis=1)
+            cycle = ~fixed & np.all(x_next == x_prev, axis=1) if x_prev is not None else np.zeros_like(fixed)
+            done = fixed | cycle
+
+            rows = active[done]
+            final[rows] = x_cur[done] if (max_iter - it) % 2 == 0 else x_next[done]
+            final[active[fixed]] = x_cur[fixed]
+            iterations[rows] = it + 1
+            status[rows] = np.where(fixed[done], "converged", "cycle")
+
+            active = active[~done]
+            x_prev, x_cur = x_cur[~done], x_next[~done]
+            if len(active) == 0:
+                break
+
+        final[active] = x_cur
+        return final.astype(int), iterations, status
+
+    def predict_block(self, x, block_size=32, max_sweeps=200):
+        """
+        Block-sequential recall: each sweep visits the units in a new random
+        order, in disjoint blocks of block_size, and updates a whole block
+        at once from the current state (one product per block).
+        block_size 1 is asynchronous recall and N synchronous; energy can
+        only rise through couplings inside a block, so blocks small
+        compared to N converge like asynchronous updates.
+        Stops after a sweep that changes nothing, returns (states, sweeps)
+        """
+        N = self.W.shape[0]
+        x_cur = np.array(x.T, dtype=np.int8)
+
+        for sweep in range(1, max_sweeps + 1):
+            changed = False
+            order = np.random.permutation(N)
+            for start in range(0, N, block_size):
+                block = order[start : start + block_size]
+                new = sign(self.W[block] @ x_cur + self.tie_eps)
+                if not np.array_equal(new, x_cur[block]):
+                    x_cur[block] = new
+                    changed = True
+            if not changed:
+                break
+
+        return x_cur.T.astype(int), sweep
+
+    def predict_async(self, x, max_iter=100000, incremental=True, trace=None):
+        """
+        incremental keeps the local fields W x (and W^T x) and updates them
+        and the energy in O(N) per flip instead of recomputing x^T W x.
+        Energies go to trace (an EnergyTrace, a new growing one by default),
+        kept as self.past_energy and flushed to its stream on return.
+        """
 
         same_energy_count = 0
 
-        self.past_energy = []
+        self.past_energy = trace if trace is not None else EnergyTrace()
 
         x_cur = np.copy(x.T)
+
+        if incremental:
+            symmetric = np.array_equal(self.W, self.W.T)
+            field = self.W @ x_cur
+            field_T = field if symmetric else self.W.T @ x_cur
+            quad = np.sum(x_cur * field)  # x^T W x
+
         for _ in range(max_iter):
             idx = np.random.choice(self.W.shape[0])
-            x_cur[idx] = np.sign(np.dot(self.W[idx], x_cur))
-            self.past_energy.append(self.energy(x_cur))
-            if _ > 1 and self.past_energy[-2] == self.past_energy[-1]:
+
+            if incremental:
+                new = np.sign(field[idx])
+                delta = new - x_cur[idx]
+                if delta != 0:
+                    quad += delta * (field[idx] + field_T[idx] + delta * self.W[idx, idx])
+                    x_cur[idx] = new
+                    field += delta * self.W[:, idx]
+                    if not symmetric:
+                        field_T += delta * self.W[idx]
+                energy = np.round(-self.scale * quad, 5)
+            else:
+                x_cur[idx] = np.sign(np.dot(self.W[idx], x_cur))
+                energy = self.energy(x_cur)
+            self.past_energy.append(energy)
+
+            if _ > 1 and energy == last_energy:
                 if same_energy_count >= 5000:
                     break
                 else:
                     same_energy_count += 1
             else:
                 same_energy_count = 0
+            last_energy = energy
 
+        # a streaming trace only writes whole buffers on its own
+        self.past_energy.flush()
         return x_cur
 
-    def get_attractors(self):
-        attractors = set()
+    def predict_async_batch(self, X, max_iter=100000, patience=5000, traces=None, every=1, block=1024):
+        """
+        Asynchronous recall of every row of X in lockstep, each row with its
+        own random update order, stopping per row once its energy has been
+        flat for patience updates (as in predict_async).
+        Row b's energies go to traces[b] (new EnergyTrace(every=every) by
+        default) in runs of up to block updates, so besides the traces only
+        a (block, rows) buffer is kept and stopped rows record nothing.
+        Returns (final states, traces)
+        """
+        x_cur = np.array(X)
+        B, N = x_cur.shape
+
+        if traces is None:
+            traces = [EnergyTrace(every=every) for _ in range(B)]
+
+        symmetric = np.array_equal(self.W, self.W.T)
+        diag = np.diag(self.W)
+        field = x_cur @ self.W.T  # row b is W x_b
+        field_T = field if symmetric else x_cur @ self.W
+        quad = np.sum(x_cur * field, axis=1)  # x_b^T W x_b
+
+        energies = np.empty((min(max_iter, block), B))
+        block_start = 0
+        length = np.full(B, max_iter)
+        last = np.empty(B)
+        same_energy_count = np.zeros(B, dtype=int)
+        active = np.arange(B)
+
+        def record(stop):
+            # rows' energies from block_start to stop (or to where they ended)
+            for b in range(B):
+                n = min(length[b], stop) - block_start
+                if n > 0:
+                    traces[b].extend(energies[:n, b])
+
+        for it in range(max_iter):
+            if it - block_start == len(energies):
+                record(it)
+                block_start = it
+
+            idx = np.random.randint(N, size=len(active))
+            f = field[active, idx]
+            new = np.sign(f)
+            delta = new - x_cur[active, idx]
+
+            # only rows that flipped need their fields updated
+            flip = delta != 0
+            rows, cols, d = active[flip], idx[flip], delta[flip]
+            quad[rows] += d * (f[flip] + field_T[rows, cols] + d * diag[cols])
+            x_cur[rows, cols] = new[flip]
+            field[rows] += d[:, None] * self.W[:, cols].T
+            if not symmetric:
+                field_T[rows] += d[:, None] * self.W[cols]
+
+            energy = np.round(-self.scale * quad[active], 5)
+            energies[it - block_start, active] = energy
+
+            if it > 1:
+                same = energy == last[active]
+            else:
+                same = np.zeros(len(active), dtype=bool)
+            last[active] = energy
+            done = same & (same_energy_count[active] >= patience)
+            same_energy_count[active] = np.where(same, same_energy_count[active] + 1, 0)
+
+            length[active[done]] = it + 1
+            active = active[~done]
+            if len(active) == 0:
+                break
+
+        record(it + 1)
+        for trace in traces:
+            trace.flush()
+        return x_cur, traces
+
+    def get_attractors(self, block_size=2**14, processes=None):
+        """
+        Relax all 2^N states in blocks of block_size, optionally spread over
+        a pool of processes, returns the set of attractors as strings
+        """
         N = self.W.shape[0]
-        for i in range(2**N):
-            a = np.array(list(f"{i:b}".zfill(N)), dtype=int) * 2 - 1
-            p = self.predict_sync(a)
-            attractors.add(np.array2string(p))
+        blocks = [(start, min(start + block_size, 2**N)) for start in range(0, 2**N, block_size)]
+
+        # Relax on the unnormalised Hebbian sums: same fixed points, but
+        # integer valued so a field of exactly 0 stays 0 in batched products
+        net = self
+        if getattr(self, "rule", None) == "hebbian":
+            net = Hopfield()
+            net.W = self.W_acc.astype(np.float64)
+            if self.delete_diagonal:
+                np.fill_diagonal(net.W, 0)
+
+        packed = set()
+        if processes:
+            with Pool(processes) as pool:
+                for found in pool.imap_unordered(partial(attractorBlock, net), blocks):
+                    packed |= found
+        else:
+            for block in blocks:
+                packed |= attractorBlock(net, block)
+
+        attractors = set()
+        for p in packed:
+            attractors.add(np.array2string(unpack(np.frombuffer(p, dtype=np.uint8), N).astype(int)))
         return attractors
 
+    def recalled(self, states, chunk_size=1024):
+        """
+        Index of the stored pattern each row of states equals, -1 for none,
+        compared with chunk_size stored patterns at a time so the all-pairs
+        XOR stays (states, chunk_size, N/8) however many are stored
+        """
+        packed = pack(states)[:, np.newaxis]
+        index = np.full(len(packed), -1)
+        for start in range(0, self.n_patterns, chunk_size):
+            same = hamming(packed, self.stored[np.newaxis, start : start + chunk_size]) == 0
+            found = (index < 0) & same.any(axis=1)
+            index[found] = start + same[found].argmax(axis=1)
+        return index
+
     def energy(self, x):
-        return np.round(-1 * x.T @ self.W @ x, 5)
+        # in the weights' precision, int64 for exact integer weights
+        x = np.asarray(x, dtype=np.int64 if np.issubdtype(self.W.dtype, np.integer) else self.W.dtype)
+        return np.round(-self.scale * (x.T @ self.W @ x), 5)
+
+
+def attractorBlock(net, block):
+    """
+    Relax the states whose bits (MSB first) are the integers in
+    range(*block), returns the packed bytes of the distinct fixed points
+    """
+    N = net.W.shape[0]
+    ints = np.arange(*block, dtype=np.int64)
+    states = ((ints[:, np.newaxis] >> np.arange(N - 1, -1, -1)) & 1).astype(np.int8) * 2 - 1
+    p = net.predict_sync(states)
+    return set(map(bytes, pack(p)))
+
 
 if __name__ == "__main__":
 
@@ -1,11 +1,31 @@
 import matplotlib.pyplot as plt
 import numpy as np
+import os
+import glob
 from _3_1 import Hopfield
 
-def loadImgs():
-    with open("pict.dat", "r") as f:
-        dat = f.read().split(",")   
-    return np.reshape(dat, (len(dat)//1024,1024)).astype(int)
+def loadImgs(fname="pict.dat"):
+    """
+    Parse fname once into an int8 .npy cache (keyed on its mtime and size)
+    and memory-map the cache on every later load
+    """
+    stat = os.stat(fname)
+    cache = f"{fname}.{stat.st_mtime_ns}-{stat.st_size}.npy"
+
+    if not os.path.exists(cache):
+        with open(fname, "r") as f:
+            dat = f.read().split(",")
+        dat = np.reshape(dat, (len(dat)//1024,1024)).astype(np.int8)
+
+        # drop caches of older versions of fname
+        for old in glob.glob(f"{fname}.*.npy"):
+            os.remove(old)
+
+        with open(f"{cache}.tmp", "wb") as f:
+            np.save(f, dat)
+        os.replace(f"{cache}.tmp", cache)
+
+    return np.load(cache, mmap_mode="r")
 
 def showImage(data_array, title=None, save_file=None, show_image=True, wait=None):
     plt.axis("off")
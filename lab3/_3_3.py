@@ -34,10 +34,8 @@ if __name__ == "__main__":
     for i, im in enumerate(images[9:]):
         print (f"p{i+10} & distorted &", net.energy(im))
 
-    p = []
-    for i in (9,10):
-        net.predict_async(images[i])
-        p.append((f"p{i+1}", net.past_energy))
+    _, traces = net.predict_async_batch(images[9:11])
+    p = [(f"p{i+1}", trace) for i, trace in zip((9, 10), traces)]
 
     plotCurves(dict(p), "Iterations", "Energy", "Iterations vs Energy", save_file="pictures/3_3_it_vs_energy.png")
 
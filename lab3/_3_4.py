@@ -3,49 +3,59 @@ from _3_2 import loadImgs, showImage
 import numpy as np
 import matplotlib.pyplot as plt
 
-if __name__ == "__main__":
 
-    images = loadImgs()[:3]
+def noiseRobustness(net, images, percents, trials=50, rng=np.random):
+    """
+    Flip int(percent * N) random units of every image, trials times per
+    noise level, and recall all distorted copies in one batched pass.
+    Returns (recovered (images, trials, levels), max recoverable noise
+    (images, trials), recalled states (images, trials, levels, N))
+    """
+    n_images, N = images.shape
+    n_flip = (np.asarray(percents) * N).astype(int)
 
-    N = images.shape[1]
+    # flip the n_flip[level] units with the smallest random keys
+    keys = rng.random((n_images, trials, len(percents), N))
+    ranks = np.argsort(np.argsort(keys, axis=-1), axis=-1)
+    flips = np.where(ranks < n_flip[:, np.newaxis], -1, 1).astype(np.int8)
+    noisy = flips * images[:, np.newaxis, np.newaxis, :]
 
-    # train p1 p2 p3
-    net = Hopfield()
-    net.train(images)
+    pred, _, _ = net.predict_sync_rows(noisy.reshape(-1, N))
+    pred = pred.reshape(noisy.shape)
 
-    percents = np.round(np.arange(0.05, 1.01, 0.05), 2)
+    recovered = np.all(pred == images[:, np.newaxis, np.newaxis, :], axis=-1)
+    max_noise = np.max(np.where(recovered, percents, 0), axis=-1)
 
-    print("Image & Max Noise Mean & Max Noise Std")
+    return recovered, max_noise, pred
 
-    # For different images check
-    for i, image_original in enumerate(images):
 
-        max_noise = []
+def plotNoise(predictions, percents, title, save_file=None):
+    rows = int(np.ceil(len(percents) / 5))
+    for j, (predict, noise_percent) in enumerate(zip(predictions, percents)):
+        plt.subplot(rows, 5, j + 1)
+        showImage(predict, title=f"Noise={noise_percent}", show_image=False)
 
-        for k in range(50):
+    plt.suptitle(title)
+    plt.tight_layout(rect=[0, 0.03, 1, 0.95])
+    if save_file:
+        plt.savefig(save_file, bbox_inches='tight')
+    plt.clf()
 
-            max_noise_recoverable = 0
 
-            for j, noise_percent in enumerate(percents):
+if __name__ == "__main__":
 
-                args = np.random.choice(N, int(noise_percent * N), replace=False)
-                image_noise = np.copy(image_original)
-                image_noise[args] = image_noise[args] * -1
+    images = loadImgs()[:3]
 
-                predict = net.predict_sync(image_noise)
-                recovered = np.all(predict == image_original)
-                max_noise_recoverable = (
-                    noise_percent if recovered else max_noise_recoverable
-                )
+    # train p1 p2 p3
+    net = Hopfield()
+    net.train(images)
 
-                if k == 0:
-                    plt.subplot(4, 5, j + 1)
-                    showImage(predict, title=f"Noise={noise_percent}", show_image=False)
+    percents = np.round(np.arange(0.05, 1.01, 0.05), 2)
+
+    recovered, max_noise, predictions = noiseRobustness(net, images, percents)
 
-            max_noise.append(max_noise_recoverable)
+    print("Image & Max Noise Mean & Max Noise Std")
 
-        print(f"P{i+1} & {np.mean(max_noise)} & {np.std(max_noise)}")
-        plt.suptitle(f"P{i+1}")
-        plt.tight_layout(rect=[0, 0.03, 1, 0.95])
-        plt.savefig(f"pictures/3_4_P{i+1}_noise.png", bbox_inches='tight')
-        plt.clf()
+    for i in range(len(images)):
+        print(f"P{i+1} & {np.mean(max_noise[i])} & {np.std(max_noise[i])}")
+        plotNoise(predictions[i, 0], percents, f"P{i+1}", save_file=f"pictures/3_4_P{i+1}_noise.png")
@@ -1,132 +1,92 @@
-from _3_1 import Hopfield, sign
+from _3_1 import Hopfield, sign, pack, hamming
 from _3_2 import loadImgs, showImage
 from _3_3 import plotCurves
+from montecarlo import monteCarlo
 import numpy as np
 import matplotlib.pyplot as plt
 
 import pickle
 
-if __name__ == "__main__":
-
-    images = loadImgs()[:9]
-    images = np.flip(images, axis=0)
-
-    def predictStableSamples(_images, noiseLevel):
-
-        N = _images.shape[1]
-        performance = []
-
-        stable_images = []
-
-        for train_idx in range(len(_images)):
-
-            target = _images[: train_idx + 1]
-
-            net = Hopfield()
-            net.train(target)
-
-            # last attempt still stable?
-            sum_stable = 0
-            if train_idx > 0:
-                pred = net.predict_sync(stable_images, max_iter=1)
-                for index in range(train_idx):
-                    if net.energy(pred[index]) == net.energy(stable_images[index]):
-                        sum_stable += 1
-                sum_stable = sum_stable / (train_idx)
-                performance.append(sum_stable)
-
-            # calculate new stable images
-            # add noise
-            args = np.random.choice(N, int(noiseLevel * N), replace=False)
-            noisy = np.copy(target)
-            noisy[:, args] = noisy[:, args] * -1
-
-            stable_images = net.predict_sync(noisy)
-            passed = np.all(stable_images == target)
-
-            print(train_idx, "sum_stable", sum_stable)  # , "passed: ", passed)
-
-        return performance
 
-    def checkStable(_images, noiseLevel, delete_diagonal=False):
+def capacitySweep(_images, noiseLevel, delete_diagonal=False, n_noise=1, rng=np.random, rule="hebbian"):
+    """
+    Grow a single network one pattern at a time (rank-1 weight updates)
+    instead of retraining on every prefix of _images.
 
-        N = _images.shape[1]
+    Each step recalls every stored pattern and every noise realisation of
+    it in one batched predict_sync_rows and checks, with one synchronous
+    update, whether the recall results of the previous step are still stable.
 
-        perf = []
-        perf_noise = []
+    Returns (performance, stable, stable_noisy), performance[k] is the
+    fraction of noisy patterns recovered with k+1 patterns stored and
+    stable[k] / stable_noisy[k] the fraction of previous clean / noisy
+    fixed points still stable with k+2 patterns stored.
+    """
+    P, N = _images.shape
 
-        for train_idx in range(0, len(_images)):
+    # one fixed flip mask per (noise realisation, pattern)
+    flips = np.ones((n_noise, P, N), dtype=np.int8)
+    args = np.argsort(rng.random((n_noise, P, N)), axis=2)[:, :, : int(noiseLevel * N)]
+    np.put_along_axis(flips, args, -1, axis=2)
+    noisy = flips * _images
 
-            target = _images[: train_idx + 1]
-            target_noisy = np.copy(target)
+    net = Hopfield()
+    net.train(_images[:1], delete_diagonal=delete_diagonal, rule=rule)
 
-            for i in range(len(target_noisy)):
-                args = np.random.choice(N, int(noiseLevel * N), replace=False)
-                target_noisy[i, args] = target_noisy[i, args] * -1
+    performance = []
+    stable = []
+    stable_noisy = []
 
-            net = Hopfield()
-            net.train(target, delete_diagonal=delete_diagonal)
+    for train_idx in range(P):
 
-            # try reconverging the last image (target) from a noisy version of target
+        target = _images[: train_idx + 1]
 
-            if train_idx > 0:
-                one_iter = net.predict_sync(target[:-1, :], max_iter=1)
-                stable = np.sum(np.all(stable == one_iter, axis=1)) / len(stable)
-                perf.append(stable)
+        if train_idx > 0:
+            net.add_patterns(_images[train_idx])
 
-                one_iter_noisy = net.predict_sync(target_noisy[:-1, :], max_iter=1)
-                stable_noisy = np.sum(
-                    np.all(stable_noisy == one_iter_noisy, axis=1)
-                ) / len(stable_noisy)
-                perf_noise.append(stable_noisy)
+            # previous fixed points still stable?
+            prev = np.vstack((prev_clean, prev_noisy))
+            one_iter = net.predict_sync(prev, max_iter=1)
+            still = np.all(one_iter == prev, axis=1)
+            stable.append(np.mean(still[:train_idx]))
+            stable_noisy.append(np.mean(still[train_idx:]))
 
-                print(train_idx, stable, stable_noisy)
+        # recall the stored patterns and all noisy realisations in one batch
+        noisy_cur = noisy[:, : train_idx + 1].reshape(-1, N)
+        pred, _, _ = net.predict_sync_rows(np.vstack((target, noisy_cur)))
+        prev_clean, prev_noisy = pred[: train_idx + 1], pred[train_idx + 1 :]
 
-                if np.sum(perf[-10:]) == 0:
-                    break
+        # compare packed against the network's packed stored patterns
+        recovered = hamming(pack(prev_noisy).reshape(n_noise, train_idx + 1, -1), net.stored) == 0
+        performance.append(np.mean(recovered))
 
-            stable = net.predict_sync(target)
-            stable_noisy = net.predict_sync(target_noisy)
+        # Skip rest if performance drops to 0
+        if np.sum(performance[-10:]) == 0:
+            break
 
-        return perf, perf_noise
+    return performance, stable, stable_noisy
 
-    def tryToTrainPredict(_images, noiseLevel, delete_diagonal=False):
 
-        N = _images.shape[1]
-        performance = []
+def randomCapacityTrial(rng, n_patterns, N, noiseLevel, delete_diagonal=False):
+    """
+    capacitySweep on n_patterns random N-unit images, for monteCarlo
+    """
+    images = sign(rng.standard_normal((n_patterns, N)))
+    return capacitySweep(images, noiseLevel, delete_diagonal=delete_diagonal, rng=rng)
 
-        for train_idx in range(len(_images)):
-            target = _images[: train_idx + 1]
-            net = Hopfield()
-            net.train(target, delete_diagonal)
 
-            # try reconverging the last image (target) from a noisy version of target
-            noisy = np.copy(target)
-            for i in range(len(noisy)):
-                args = np.random.choice(N, int(noiseLevel * N), replace=False)
-                noisy[i, args] = noisy[i, args] * -1
-
-            pred = net.predict_sync(noisy)
-
-            # performance rate
-            perf = np.sum(np.all(pred == target, axis=1)) / len(pred)
-            performance.append(perf)
-
-            print(train_idx + 1, perf)
-
-            # Skip rest if performance drops to 0
-            if np.sum(performance[-10:]) == 0:
-                break
+if __name__ == "__main__":
 
-        return performance
+    images = loadImgs()[:9]
+    images = np.flip(images, axis=0)
 
     # 3.5.1
-    # resultImages = tryToTrainPredict(images, 0.2)
-    # resultImages0Diagonal = tryToTrainPredict(images, 0.2, delete_diagonal=True)
+    # resultImages = capacitySweep(images, 0.2)[0]
+    # resultImages0Diagonal = capacitySweep(images, 0.2, delete_diagonal=True)[0]
 
     # randomImages = sign(np.random.randn(200, images.shape[1]))
-    # resultRandom = tryToTrainPredict(randomImages, 0.2)
-    # resultRandom0Diagonal = tryToTrainPredict(randomImages, 0.2, delete_diagonal=True)
+    # resultRandom = capacitySweep(randomImages, 0.2)[0]
+    # resultRandom0Diagonal = capacitySweep(randomImages, 0.2, delete_diagonal=True)[0]
 
     # save = (resultImages, resultImages0Diagonal, resultRandom, resultRandom0Diagonal)
     # pickle.dump(save, open("perf.pkl", "wb"))
@@ -157,22 +117,20 @@ if __name__ == "__main__":
         save_file="pictures/3_5_1_given.png",
     )
 
-    # 3.5.2
-    randomImages = sign(np.random.randn(300, 100))
-    # stable, stable_noise = checkStable(randomImages, 0.2)
-    # stable_0d, stable_noise_0d = checkStable(randomImages, 0.2, delete_diagonal=True)
-
-    # pickle.dump((stable_0d, stable_noise_0d), open("stability_od.pkl", "wb"))
-    stable, stable_noise = pickle.load(open("stability.pkl", "rb"))
-    stable_0d, stable_noise_0d = pickle.load(open("stability_od.pkl", "rb"))
-
+    # 3.5.2 averaged over random image sets, resumes from the pickles if interrupted
+    curves = {}
+    for label, delete_diagonal, save_file in (
+        ("", False, "stability_mc.pkl"),
+        (" (0-Diag)", True, "stability_mc_od.pkl"),
+    ):
+        trials = monteCarlo(randomCapacityTrial, 20, save_file, args=(300, 100, 0.2, delete_diagonal))
+        # sweeps stop at different sizes, average over the common part
+        length = min(len(stable) for _, stable, _ in trials)
+        curves["No Noise" + label] = np.mean([stable[:length] for _, stable, _ in trials], axis=0)
+        curves["Noisy" + label] = np.mean([noisy[:length] for _, _, noisy in trials], axis=0)
 
     plotCurves(
-        {"No Noise": stable, 
-        "Noisy": stable_noise,
-        "No Noise (0-Diag)": stable_0d, 
-        "Noisy (0-Diag)": stable_noise_0d
-        },
+        curves,
         "Images trained",
         "Stable",
         "Stability",
@@ -180,28 +138,28 @@ if __name__ == "__main__":
     )
 
     # 3.5.3
+    N = 100
     randomImages = sign(0.5 + np.random.randn(100, N))
 
     print(randomImages.shape)
     print("\n", "Removed self connections")
     plotCurves(
-        {"Performance": tryToTrainPredict(randomImages, 0.2, delete_diagonal=True)},
+        {"Performance": capacitySweep(randomImages, 0.2, delete_diagonal=True)[0]},
         "Images trained",
         "identified correct",
         "Performance w/o Self Connection",
         save_file="pictures/3_5_performance_wo_wii_images_bias.png",
     )
 
-    N = 100
     randomImages = sign(np.random.randn(300, N))
     print(randomImages.shape)
 
     print("\n", "stable after adding to Weight")
-# plotCurves(
-#         {"Performance": predictStableSamples(randomImages, 0.2)},
-#         "Images trained",
-#         "stable samples",
-#         "Performance per trained Images (random samples)",
-#         save_file="pictures/3_5_performance_noise_stable_samples.png",
-#     )
+    plotCurves(
+        {"Performance": capacitySweep(randomImages, 0.2)[2]},
+        "Images trained",
+        "stable samples",
+        "Performance per trained Images (random samples)",
+        save_file="pictures/3_5_performance_noise_stable_samples.png",
+    )
 
@@ -1,77 +1,207 @@
 import numpy as np
+import scipy.sparse as sp
 from _3_3 import plotCurves
 import matplotlib.pyplot as plt
+from _3_1 import sign
+from montecarlo import monteCarlo
 
-sign = np.vectorize(lambda x: np.where(x >= 0, 1, -1))
-
-
-# sign = np.sign
 
 class sparse_Hopfield:
-    def train(self, samples, activity):
-        width = samples.shape[1]
-        self.W = np.zeros((width, width))
-        for x in samples:
-            self.W += np.outer(x-activity, x-activity)
+    def __init__(self, storage="auto", dtype=np.float64):
+        """
+        storage: "dense" (N x N weights), "csr" (sparse X^T X plus
+        rank-one corrections), "lowrank" (keeps the sparse pattern matrix X,
+        W x = X^T (X x) + corrections) or "auto" (cheapest recall)
+        dtype: float32 halves memory, float64 keeps the old precision
+        Fields within tie_eps of the bias count as on (sign(0) = 1) so every
+        backend breaks exact ties the same way despite its summation order,
+        float32 can't tell apart fields closer than that
+        """
+        self.storage = storage
+        self.dtype = dtype
+        self.tie_eps = 1000 * np.finfo(dtype).eps
 
-        # Do we get rid of diagonal?
-        np.fill_diagonal(self.W,0)
-
-        self.W = self.W / len(samples)
+    def train(self, samples, activity):
+        self.init_weights(samples.shape[1], activity, self.cheapest(samples))
+        self.add_patterns(samples)
+
+    def cheapest(self, samples):
+        """
+        Backend with the fewest multiply-adds per recalled state
+        """
+        if self.storage != "auto":
+            return self.storage
+
+        N = samples.shape[1]
+        X = sp.csr_matrix(samples)
+        cost = {
+            "dense": N * N,
+            "csr": np.sum(np.diff(X.indptr) ** 2),
+            "lowrank": 2 * X.nnz,
+        }
+        return min(cost, key=cost.get)
+
+    def init_weights(self, width, activity, backend):
+        self.activity = activity
+        self.backend = backend
+        self.n_patterns = 0
+
+        if backend == "dense":
+            self.W_acc = np.zeros((width, width), dtype=self.dtype)  # unnormalised
+            return
+
+        # off the diagonal (X - a)^T (X - a) = X^T X - a (s 1^T + 1 s^T) + P a^2 1 1^T,
+        # the diagonal is left out of every term so empty fields stay exactly 0
+        self.s = np.zeros(width)
+        self.sum_sq = np.zeros(width)
+        if backend == "csr":
+            self.G = sp.csr_matrix((width, width), dtype=self.dtype)
+        elif backend == "lowrank":
+            self.X = sp.csr_matrix((0, width), dtype=self.dtype)
+        else:
+            raise ValueError(f"unknown storage {backend}")
+
+    def add_patterns(self, samples):
+        """
+        Add patterns without retraining
+        """
+        samples = np.atleast_2d(samples)
+        self.n_patterns += len(samples)
+        a, P = self.activity, self.n_patterns
+
+        if self.backend == "dense":
+            C = (samples - a).astype(self.dtype)
+            self.W_acc += C.T @ C
+
+            # Do we get rid of diagonal?
+            np.fill_diagonal(self.W_acc, 0)
+            return
+
+        X = sp.csr_matrix(samples, dtype=self.dtype)
+        self.s += np.asarray(X.sum(axis=0)).ravel()
+        self.sum_sq += np.asarray(X.multiply(X).sum(axis=0)).ravel()
+
+        if self.backend == "csr":
+            self.G = (self.G + X.T @ X).tocsr()
+            self.G.setdiag(0)
+            self.G.eliminate_zeros()
+        else:
+            self.X = sp.vstack((self.X, X), format="csr")
+
+    def field(self, x, out=None):
+        """
+        W x for states x (N,) or (N, B)
+        """
+        a, P = self.activity, self.n_patterns
+
+        if self.backend == "dense":
+            out = np.matmul(self.W_acc, x, out=out)
+            out /= P
+            return out
+
+        x2 = x.reshape(len(x), -1).astype(self.dtype)
+
+        if self.backend == "csr":
+            Gx = self.G @ x2
+        else:
+            Gx = self.X.T @ (self.X @ x2) - self.sum_sq[:, np.newaxis] * x2
+
+        # 1^T x and s^T x without the unit's own term
+        ones_x = x2.sum(axis=0) - x2
+        s_x = self.s @ x2 - self.s[:, np.newaxis] * x2
+        f = Gx - a * self.s[:, np.newaxis] * ones_x - a * s_x + P * a**2 * ones_x
+        f /= P
+
+        if out is None:
+            return f.reshape(x.shape)
+        out[...] = f.reshape(x.shape)
+        return out
 
     def predict_sync(self, x, bias, max_iter=200):
 
-        # self.past_energy = []
-        x_cur = np.copy(x.T)
+        # int8 0/1 states, buffers reused across iterations
+        x_cur = np.array(x.T, dtype=np.int8)
+        x_next = np.empty_like(x_cur)
+        field = np.empty(x_cur.shape, dtype=self.dtype)
 
         for _ in range(max_iter):
-            # self.past_energy.append(self.energy(x_cur))
-            x_next = 0.5 + 0.5*sign((self.W @ x_cur) - bias)
-            if np.all(x_next == x_cur):
+            self.field(x_cur, out=field)
+            field -= bias - self.tie_eps
+            sign(field, out=x_next, low=0)
+            if np.array_equal(x_next, x_cur):
                 break
-            x_cur = x_next
+            x_cur, x_next = x_next, x_cur
         
         return x_cur.T.astype(int)
 
 
+def capacityVsBias(X, activity, biases, storage="auto", dtype=np.float64, max_iter=200):
+    """
+    For every bias, the number of leading patterns of X stored before the
+    newest one is no longer recalled.
+    The network is trained once, incrementally, and each new pattern is
+    recalled for all remaining biases at once as a (unit, bias) state matrix.
+    Unlike the old per-bias retraining loop the new pattern is recalled on
+    its own (not next to all stored ones) and exact field/bias ties follow
+    tie_eps, so counts can differ from it where those mattered.
+    """
+    P, N = X.shape
+    biases = np.asarray(biases)
+
+    capacity = np.full(len(biases), P)
+    active = np.arange(len(biases))
+
+    net = sparse_Hopfield(storage, dtype)
+    net.init_weights(N, activity, net.cheapest(X))
+
+    for i in range(P):
+        net.add_patterns(X[i])
+
+        target = X[i][:, np.newaxis]
+        x_cur = np.repeat(target, len(active), axis=1).astype(np.int8)
+        x_next = np.empty_like(x_cur)
+        field = np.empty(x_cur.shape, dtype=net.dtype)
+
+        for _ in range(max_iter):
+            net.field(x_cur, out=field)
+            field -= biases[active] - net.tie_eps
+            sign(field, out=x_next, low=0)
+            if np.array_equal(x_next, x_cur):
+                break
+            x_cur, x_next = x_next, x_cur
+
+        failed = np.any(x_cur != target, axis=0)
+        capacity[active[failed]] = i
+        active = active[~failed]
+        if len(active) == 0:
+            break
+
+    return capacity
+
+
+def capacityVsBiasTrial(rng, activity, biases, samples=200, N=100):
+    """
+    capacityVsBias on samples random patterns with int(activity * N) active units, for monteCarlo
+    """
+    ranks = np.argsort(rng.random((samples, N)), axis=1)
+    X = (ranks < int(activity * N)).astype(int)
+    return capacityVsBias(X, activity, biases)
+
+
 if __name__ == "__main__":
 
     N=100
     samples = 200
-    net = sparse_Hopfield()
 
     #how many patterns can be stored in network?
 
-    def max_trained_patterns(b_in, activity):
-        max_trained_patterns = 0
-        for i in range(samples):
-            
-            targets = X[:i+1]
-
-            net.train(targets, activity)
-            pred = net.predict_sync(targets,b_in)
-            # print (np.mean(pred))
-            if np.all(pred[i] == targets[i]):
-                #print(i, pred[i], X[i])
-                max_trained_patterns = i+1
-            else:
-                break
-        return max_trained_patterns
-
     biases = np.arange(0,2.01,0.05)
 
     for activity in (0.1, 0.05, 0.01):
 
-        X = np.zeros([samples,N],dtype=int)
-        for index in range(samples):
-            args = np.random.choice(N, int(activity * N), replace=False)
-            X[index, args] = X[index, args] + 1
-    
-        trained = []
-        for bias in biases:
-            n = max_trained_patterns(bias, activity)
-            # print("max patterns: (bias ", bias, ") ", n)
-            trained.append(n)
+        # averaged over random pattern sets, resumes from the pickle if interrupted
+        trials = monteCarlo(capacityVsBiasTrial, 10, f"capacity_bias_{activity}.pkl", args=(activity, biases, samples, N))
+        trained = np.mean(trials, axis=0)
 
         plt.plot(biases, trained, label=f"activity={activity}")
 
@@ -0,0 +1,81 @@
+import timeit
+import numpy as np
+from _3_1 import Hopfield, sign
+from _3_2 import loadImgs
+
+# the old per-element threshold, kept for comparison
+vectorized_sign = np.vectorize(lambda x: np.where(x >= 0, 1, -1))
+
+
+def timeIt(f, number):
+    return min(timeit.repeat(f, number=number, repeat=3)) / number
+
+
+def benchSign(N, n_states=1, number=20):
+    """
+    Per-iteration cost of a synchronous update (W @ x then threshold)
+    """
+    X = sign(np.random.randn(n_states, N))
+    net = Hopfield()
+    net.train(X)
+
+    x = X.T
+    field = np.empty(x.shape)
+    out = np.empty_like(x)
+
+    t_old = timeIt(lambda: vectorized_sign(net.W @ x), number)
+    t_new = timeIt(lambda: sign(np.matmul(net.W, x, out=field), out=out), number)
+    return t_old, t_new
+
+
+def benchDtype(N, dtype, n_patterns=20, n_states=10, number=3):
+    """
+    Weight memory and time of a full synchronous recall of n_states noisy patterns
+    """
+    X = sign(np.random.randn(n_patterns, N))
+    net = Hopfield()
+    net.train(X, dtype=dtype)
+
+    noisy = X[:n_states].copy()
+    noisy[:, : N // 10] *= -1
+
+    t = timeIt(lambda: net.predict_sync(noisy), number)
+    return net.W.nbytes, t
+
+
+def checkRowsMatchSync(n_patterns=3, trials=200, noise=0.3, dtype=np.float64, rng=np.random):
+    """
+    Rows recalled by predict_sync_rows that differ from per-row predict_sync,
+    on noisy copies of the first n_patterns lab images (0 when both break
+    field ties the same way)
+    """
+    images = np.asarray(loadImgs()[:n_patterns])
+    net = Hopfield()
+    net.train(images, dtype=dtype)
+
+    N = images.shape[1]
+    flips = np.ones((n_patterns * trials, N), dtype=images.dtype)
+    args = np.argsort(rng.random(flips.shape), axis=1)[:, : int(noise * N)]
+    np.put_along_axis(flips, args, -1, axis=1)
+    noisy = flips * np.repeat(images, trials, axis=0)
+
+    rows, _, _ = net.predict_sync_rows(noisy)
+    return sum(not np.array_equal(net.predict_sync(x[np.newaxis])[0], r) for x, r in zip(noisy, rows))
+
+
+if __name__ == "__main__":
+
+    for dtype in (np.float64, np.float32):
+        print(np.dtype(dtype).name, "rows differing from predict_sync:", checkRowsMatchSync(dtype=dtype))
+
+    print("N & States & np.vectorize (ms) & sign kernel (ms) \\\\")
+    for N in (1024, 4096):
+        for n_states in (1, 10):
+            t_old, t_new = benchSign(N, n_states, number=5 if N > 1024 else 20)
+            print(N, "&", n_states, "&", f"{t_old * 1e3:.3f}", "&", f"{t_new * 1e3:.3f}", "\\\\")
+
+    print("N & Weights & Memory (MB) & Recall (ms) \\\\")
+    for N in (1024, 4096):
+        for dtype in (np.float64, np.float32, np.int32):
+            nbytes, t = benchDtype(N, dtype, number=3 if N > 1024 else 10)
+            print(N, "&", np.dtype(dtype).name, "&", f"{nbytes / 2**20:.1f}", "&", f"{t * 1e3:.3f}", "\\\\")
@@ -0,0 +1,64 @@
+import os
+import pickle
+import numpy as np
+from multiprocessing import Pool
+
+
+def runTrial(task):
+    trial_fn, index, seed, args = task
+    return index, trial_fn(np.random.default_rng(seed), *args)
+
+
+def loadTrials(save_file):
+    """
+    Returns (header, {trial index: result}) saved in save_file, header is
+    (trial_fn name, args, seed), a truncated last record (interrupted run) is ignored
+    """
+    done = {}
+    if not os.path.exists(save_file):
+        return None, done
+
+    with open(save_file, "rb") as f:
+        header = pickle.load(f)
+        try:
+            while True:
+                index, result = pickle.load(f)
+                done[index] = result
+        except (EOFError, pickle.UnpicklingError):
+            pass
+
+    return header, done
+
+
+def monteCarlo(trial_fn, n_trials, save_file, seed=0, args=(), processes=None):
+    """
+    Run trial_fn(rng, *args) n_trials times over a pool of processes.
+    Trial i always gets the generator of child i of SeedSequence(seed), so
+    results don't depend on which worker ran it or in what order.
+    Every finished trial is appended to save_file, running again with the
+    same save_file, trial_fn, args and seed only runs the missing trials.
+    Returns the results in trial order.
+    """
+    header = (trial_fn.__name__, args, seed)
+    saved_header, done = loadTrials(save_file)
+    # compared pickled, args may hold arrays
+    if saved_header is not None and pickle.dumps(saved_header) != pickle.dumps(header):
+        raise ValueError(f"{save_file} was run as {saved_header}, not {header}")
+
+    # rewrite the complete records, drops a truncated tail
+    with open(f"{save_file}.tmp", "wb") as f:
+        pickle.dump(header, f)
+        for index, result in done.items():
+            pickle.dump((index, result), f)
+    os.replace(f"{save_file}.tmp", save_file)
+
+    seeds = np.random.SeedSequence(seed).spawn(n_trials)
+    tasks = [(trial_fn, i, seeds[i], args) for i in range(n_trials) if i not in done]
+
+    with open(save_file, "ab") as f, Pool(processes) as pool:
+        for index, result in pool.imap_unordered(runTrial, tasks):
+            pickle.dump((index, result), f)
+            f.flush()
+            done[index] = result
+
+    return [done[i] for i in range(n_trials)]